@@ -1,7 +1,12 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
 import ollama
-import json
+import orjson
 import re
-from memory import LongTermMemory
+from memory import get_long_term_memory, get_semantic_cache
 from tools import (
     internet_search,
     add_todo,
@@ -13,6 +18,88 @@ from todo import load_todos
 # Local LLM model used for reasoning
 MODEL_NAME = "gemma:2b"
 
+# Keep the model (and its prompt KV cache) loaded between turns
+KEEP_ALIVE = "30m"
+
+# System prompt; only retrieved_memory changes between turns, and it
+# sits at the end so the rest forms a stable prefix
+SYSTEM_PROMPT_TEMPLATE = """
+You are {agent_name}.
+Role: {agent_role}.
+
+System Instructions:
+{system_instructions}
+
+User: {user_name}
+User Info: {user_info}
+
+Rules:
+- Use tools ONLY if necessary.
+- For normal knowledge questions, answer directly.
+- Use add_todo only for explicit task creation.
+- Use complete_todo only if user clearly says task is finished.
+- Use date only for date requests.
+
+Reasoning format:
+
+{{
+ "thought": "...",
+ "action": "search | add_todo | complete_todo | date | none",
+ "action_input": "...",
+ "save_memory": true/false,
+ "memory_content": "...",
+ "final_answer": "..."
+}}
+
+Retrieved Memory:
+{retrieved_memory}
+"""
+
+# Placeholder marking where retrieved memory is spliced in
+_MEMORY_SLOT = "{retrieved_memory}"
+
+# Background workers for long-term memory writes
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+# Cache context prefix for knowledge guard answers, which only see
+# the agent role and the question
+_KNOWLEDGE_CONTEXT = "knowledge/"
+
+# References back to the conversation; answers to such follow-ups
+# depend on history and are never served from the cache
+_FOLLOWUP_RE = re.compile(
+    r"\b(?:it|its|that|this|these|those|they|them|he|she|his|her|more|again|else|above|previous|earlier|same)\b"
+)
+
+# Greedy JSON object extraction for malformed model output
+_JSON_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def _keyword_pattern(keywords, prefix=False):
+    """
+    Compile a keyword list into a single alternation pattern.
+    prefix=True anchors the match to the start of the input.
+    """
+    alternation = "|".join(re.escape(k) for k in keywords)
+    return re.compile(f"^(?:{alternation})" if prefix else alternation)
+
+
+# Deterministic routing triggers, compiled once per intent class
+_INTENT_PATTERNS = {
+    "pref": _keyword_pattern(
+        ["i like", "i love", "i prefer", "my favorite", "remember"], prefix=True
+    ),
+    "done": _keyword_pattern(["i did", "i finished", "completed"]),
+    "task": _keyword_pattern(["i need to", "i have to", "remind me to"]),
+    "date": _keyword_pattern(["today", "current date"]),
+    "knowledge": _keyword_pattern(
+        ["what is", "who is", "define", "explain", "why"], prefix=True
+    ),
+    "search_intent": _keyword_pattern(
+        ["search", "latest", "recent", "find", "trend", "news"]
+    ),
+}
+
 
 class Agent:
     """
@@ -29,58 +116,68 @@ class Agent:
 
     def __init__(self, config):
         self.config = config
-        self.memory = LongTermMemory()
-
-        # Short-term memory (conversation window)
-        self.short_term = []
+        self.memory = get_long_term_memory()
 
-        # Internal debug log (visible in UI)
-        self.internal_log = []
+        # Similarity cache for model answers, shared by all sessions
+        self.cache = get_semantic_cache()
 
         # Maximum short-term memory size
         self.max_context = 6
 
+        # Maximum retained internal log entries
+        self.max_log = 500
+
+        # Short-term memory (conversation window, oldest evicted first)
+        self.short_term = collections.deque(maxlen=self.max_context)
+
+        # Internal debug log (visible in UI)
+        self.internal_log = collections.deque(maxlen=self.max_log)
+
+        # System prompt halves around the retrieved memory slot
+        self._prompt_prefix = ""
+        self._prompt_suffix = ""
+        self._rebuild_prompt_template()
+
     # ================= SYSTEM PROMPT =================
 
+    def _rebuild_prompt_template(self):
+        """
+        Pre-format the system prompt for the current config.
+        Stores the text before and after the retrieved memory slot,
+        so per-turn construction is a plain concatenation.
+        """
+        filled = SYSTEM_PROMPT_TEMPLATE.format(
+            agent_name=self.config["agent_name"],
+            agent_role=self.config["agent_role"],
+            system_instructions=self.config.get("system_instructions", ""),
+            user_name=self.config["user_name"],
+            user_info=self.config["user_info"],
+            retrieved_memory=_MEMORY_SLOT
+        )
+        self._prompt_prefix, _, self._prompt_suffix = filled.rpartition(_MEMORY_SLOT)
+
+    def update_config(self, config):
+        """
+        Apply a (possibly edited) configuration.
+        Must be called after config changes so the prompt template
+        is rebuilt. Cached answers are keyed by the prompt, so answers
+        from the old config simply stop matching.
+        """
+        self.config = config
+        self._rebuild_prompt_template()
+
     def system_prompt(self, retrieved_memory):
         """
         Construct dynamic system prompt using:
         - User profile
         - Agent persona
-        - Retrieved long-term memory
         - Tool usage constraints
-        """
-        return f"""
-You are {self.config['agent_name']}.
-Role: {self.config['agent_role']}.
-
-System Instructions:
-{self.config.get('system_instructions', '')}
-
-User: {self.config['user_name']}
-User Info: {self.config['user_info']}
-
-Retrieved Memory:
-{retrieved_memory}
-
-Rules:
-- Use tools ONLY if necessary.
-- For normal knowledge questions, answer directly.
-- Use add_todo only for explicit task creation.
-- Use complete_todo only if user clearly says task is finished.
-- Use date only for date requests.
-
-Reasoning format:
+        - Retrieved long-term memory
 
-{{
- "thought": "...",
- "action": "search | add_todo | complete_todo | date | none",
- "action_input": "...",
- "save_memory": true/false,
- "memory_content": "...",
- "final_answer": "..."
-}}
-"""
+        Retrieved memory is the only per-turn part and goes last, so
+        the unchanged prefix can be reused from Ollama's prompt cache.
+        """
+        return self._prompt_prefix + str(retrieved_memory) + self._prompt_suffix
 
     # ================= SAFE JSON PARSER =================
 
@@ -90,45 +187,50 @@ Reasoning format:
         Attempts full parse, then regex extraction fallback.
         """
         try:
-            return json.loads(text)
+            return orjson.loads(text)
         except:
-            match = re.search(r"\{.*\}", text, re.DOTALL)
+            match = _JSON_RE.search(text)
             if match:
                 try:
-                    return json.loads(match.group())
+                    return orjson.loads(match.group())
                 except:
                     return None
             return None
 
     # ================= MODEL CALLS =================
 
-    def call_model_json(self, messages):
+    async def call_model_json(self, messages, client):
         """
         Call LLM expecting structured JSON output.
         Used for reasoning loop.
         """
         try:
-            response = ollama.chat(
+            response = await client.chat(
                 model=MODEL_NAME,
                 messages=messages,
                 format="json",
-                options={"temperature": 0.2}
+                options={"temperature": 0.2},
+                keep_alive=KEEP_ALIVE
             )
             return self.safe_parse(response["message"]["content"])
         except Exception as e:
             self.internal_log.append(f"Model JSON call failed: {str(e)}")
             return None
 
-    def call_model_plain(self, messages):
+    async def call_model_stream(self, messages, client):
         """
         Standard LLM call for natural language output.
+        Yields content chunks as the model produces them.
         """
-        response = ollama.chat(
+        stream = await client.chat(
             model=MODEL_NAME,
             messages=messages,
-            options={"temperature": 0.4}
+            options={"temperature": 0.4},
+            keep_alive=KEEP_ALIVE,
+            stream=True
         )
-        return response["message"]["content"]
+        async for chunk in stream:
+            yield chunk["message"]["content"]
 
     # ================= PROACTIVITY =================
 
@@ -171,112 +273,195 @@ Reasoning format:
 
         return result
 
+    async def execute_tool_async(self, action, action_input):
+        """
+        Run a blocking tool in a worker thread so it can overlap
+        with other work in the reasoning loop.
+        """
+        return await asyncio.to_thread(self.execute_tool, action, action_input)
+
+    # ================= ANSWER CACHE =================
+
+    def cache_context(self, system_prompt):
+        """
+        Key for what a reasoning answer depends on besides the question:
+        the full system prompt, which covers persona, user profile and
+        retrieved memory. A memory write that changes retrieval changes
+        the key, so stale answers are not served.
+        """
+        digest = hashlib.blake2b(system_prompt.encode("utf-8"), digest_size=16)
+        return digest.hexdigest()
+
+    # ================= MEMORY WRITES =================
+
+    def store_memory(self, text):
+        """
+        Queue a long-term memory write on a background worker.
+        The entry is embedded along with the next turn's query, or
+        with a full batch; failures are reported in the internal log.
+        """
+        future = _EXECUTOR.submit(self.memory.add_memory, text)
+        future.add_done_callback(self._log_memory_failure)
+
+    def _log_memory_failure(self, future):
+        error = future.exception()
+        if error:
+            self.internal_log.append(f"Memory write failed: {error}")
+
     # ================= MAIN REASONING PIPELINE =================
 
-    def process_single_intent(self, user_input):
+    async def stream_single_intent(self, user_input):
         """
         Hybrid reasoning strategy:
         - Deterministic routing for common intents
         - LLM JSON reasoning for complex cases
+
+        Yields the answer in chunks; natural language model output
+        is streamed as it is generated. One Ollama client serves every
+        model call of the turn and is closed when the turn ends.
         """
+        async with ollama.AsyncClient() as client:
+            async with contextlib.aclosing(self._stream_turn(user_input, client)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
 
+    async def _stream_turn(self, user_input, client):
         user_lower = user_input.lower().strip()
 
+        # Classify the input against every routing trigger up front
+        hits = {
+            intent for intent, pattern in _INTENT_PATTERNS.items()
+            if pattern.search(user_lower)
+        }
+
         # Always store user message first
         self.short_term.append({"role": "user", "content": user_input})
-        self.short_term = self.short_term[-self.max_context:]
 
         # 1. Deterministic preference storage
-        if (
-            user_lower.startswith("i like")
-            or user_lower.startswith("i love")
-            or user_lower.startswith("i prefer")
-            or user_lower.startswith("my favorite")
-            or user_lower.startswith("remember")
-        ) and not user_lower.endswith("?"):
+        if "pref" in hits and not user_lower.endswith("?"):
 
             memory_fact = f"User preference: {user_input.strip()}"
-            self.memory.add_memory(memory_fact)
+            self.store_memory(memory_fact)
             self.internal_log.append("Preference stored deterministically.")
 
             response = "Got it. I'll remember that."
 
             self.short_term.append({"role": "assistant", "content": response})
-            self.short_term = self.short_term[-self.max_context:]
 
-            return response
+            yield response
+            return
 
         # 2. Deterministic task completion
-        if any(k in user_lower for k in ["i did", "i finished", "completed"]):
+        if "done" in hits:
             response = complete_todo(user_input)
 
             self.short_term.append({"role": "assistant", "content": response})
-            self.short_term = self.short_term[-self.max_context:]
 
-            return response
+            yield response
+            return
 
         # 3. Deterministic task creation
-        task_triggers = ["i need to", "i have to", "remind me to"]
-        for trigger in task_triggers:
-            if trigger in user_lower:
-                task_text = user_lower.split(trigger)[-1].strip()
-                response = add_todo(task_text)
+        if "task" in hits:
+            trigger = list(_INTENT_PATTERNS["task"].finditer(user_lower))[-1]
+            task_text = user_lower[trigger.end():].strip()
+            response = add_todo(task_text)
 
-                self.short_term.append({"role": "assistant", "content": response})
-                self.short_term = self.short_term[-self.max_context:]
+            self.short_term.append({"role": "assistant", "content": response})
 
-                return response
+            yield response
+            return
 
         # 4. Deterministic date handling
-        if "today" in user_lower or "current date" in user_lower:
+        if "date" in hits:
             response = get_current_date()
 
             self.short_term.append({"role": "assistant", "content": response})
-            self.short_term = self.short_term[-self.max_context:]
 
-            return response
+            yield response
+            return
 
         # 5. Knowledge guard (smart routing)
-        knowledge_prefixes = ["what is", "who is", "define", "explain", "why"]
-
-        if any(user_lower.startswith(p) for p in knowledge_prefixes):
+        if "knowledge" in hits:
             # Allow reasoning loop if question implies external lookup
-            search_intent_keywords = ["search", "latest", "recent", "find", "trend", "news"]
-
-            if not any(k in user_lower for k in search_intent_keywords):
+            if "search_intent" not in hits:
                 self.internal_log.append("Knowledge guard triggered.")
-                response = self.call_model_plain([
-                    {"role": "system", "content": f"You are {self.config['agent_role']}."},
-                    {"role": "user", "content": user_input}
-                ])
+
+                context = _KNOWLEDGE_CONTEXT + self.config["agent_role"]
+
+                # Identical question under the same role: reuse the
+                # answer without embedding it
+                exact_key = (context, user_lower)
+                response = self.cache.lookup_exact(exact_key)
+
+                if response is None:
+                    query_vec = self.memory.embed(user_input)
+                    response = self.cache.lookup(query_vec, context)
+
+                if response is not None:
+                    self.internal_log.append("Knowledge answer served from cache.")
+                    yield response
+                else:
+                    parts = []
+                    async for chunk in self.call_model_stream([
+                        {"role": "system", "content": f"You are {self.config['agent_role']}."},
+                        {"role": "user", "content": user_input}
+                    ], client):
+                        parts.append(chunk)
+                        yield chunk
+                    response = "".join(parts)
+                    self.cache.add(query_vec, response, context, key=exact_key)
 
                 self.short_term.append({"role": "assistant", "content": response})
-                self.short_term = self.short_term[-self.max_context:]
 
-                return response
+                return
 
         # 6. LLM reasoning loop
 
-        retrieved = self.memory.query(user_input, k=2)
+        # Embed once; the vector serves both memory and cache lookup
+        query_vec = self.memory.embed(user_input)
+
+        retrieved = self.memory.query(user_input, k=2, query_embedding=query_vec)
         retrieved_docs = retrieved.get("documents", [[]])[0]
         distances = retrieved.get("distances", [[]])[0] if "distances" in retrieved else []
 
         self.internal_log.append(f"Retrieved memory: {retrieved_docs}")
         self.internal_log.append(f"Distances: {distances}")
 
+        system_prompt = self.system_prompt(retrieved_docs)
+
+        # Answers are reused for the same prompt; follow-ups that refer
+        # back to the conversation bypass the cache
+        context = None
+        if not _FOLLOWUP_RE.search(user_lower):
+            context = self.cache_context(system_prompt)
+
+            cached = self.cache.lookup(query_vec, context)
+            if cached is not None:
+                self.internal_log.append("Semantic cache hit.")
+
+                self.short_term.append({"role": "assistant", "content": cached})
+
+                yield cached
+                return
+
         messages = [
-            {"role": "system", "content": self.system_prompt(retrieved_docs)}
-        ] + self.short_term
+            {"role": "system", "content": system_prompt}
+        ] + list(self.short_term)
 
-        parsed = self.call_model_json(messages)
+        parsed = await self.call_model_json(messages, client)
 
         if not parsed:
-            response = self.call_model_plain(self.short_term)
+            parts = []
+            async for chunk in self.call_model_stream(list(self.short_term), client):
+                parts.append(chunk)
+                yield chunk
+            response = "".join(parts)
+            if context is not None:
+                self.cache.add(query_vec, response, context)
 
             self.short_term.append({"role": "assistant", "content": response})
-            self.short_term = self.short_term[-self.max_context:]
 
-            return response
+            return
 
         thought = parsed.get("thought", "")
         action = parsed.get("action", "none")
@@ -287,49 +472,77 @@ Reasoning format:
 
         self.internal_log.append(f"Thought: {thought}")
 
+        # Persisting memory is independent of the answer; run it in the background
+        if save_memory and memory_content:
+            self.store_memory(memory_content)
+            self.internal_log.append(f"Memory saved by LLM: {memory_content}")
+
         if action != "none":
-            observation = self.execute_tool(action, action_input)
+            observation = await self.execute_tool_async(action, action_input)
 
             second_messages = [
                 {"role": "system", "content": "Produce the final answer based on the observation."},
                 {"role": "user", "content": f"Observation: {observation}"}
             ]
 
-            final_answer = self.call_model_plain(second_messages)
+            parts = []
+            async for chunk in self.call_model_stream(second_messages, client):
+                parts.append(chunk)
+                yield chunk
+            final_answer = "".join(parts)
+        elif final_answer:
+            yield final_answer
 
         if not final_answer:
             self.internal_log.append("Final answer missing from JSON. Falling back to plain model.")
-            final_answer = self.call_model_plain(self.short_term)
+            parts = []
+            async for chunk in self.call_model_stream(list(self.short_term), client):
+                parts.append(chunk)
+                yield chunk
+            final_answer = "".join(parts)
 
-        self.internal_log.append(f"Thought: {thought}")
-
-        if action != "none":
-            observation = self.execute_tool(action, action_input)
-
-            second_messages = [
-                {"role": "system", "content": "Produce the final answer based on the observation."},
-                {"role": "user", "content": f"Observation: {observation}"}
-            ]
-
-            final_answer = self.call_model_plain(second_messages)
-
-        if save_memory and memory_content:
-            self.memory.add_memory(memory_content)
-            self.internal_log.append(f"Memory saved by LLM: {memory_content}")
+        # Tool answers depend on side effects and live data; never cache them
+        if action == "none" and context is not None:
+            self.cache.add(query_vec, final_answer, context)
 
         self.short_term.append({"role": "assistant", "content": final_answer})
-        self.short_term = self.short_term[-self.max_context:]
 
-        return final_answer
+    async def process_single_intent(self, user_input):
+        """
+        Run the reasoning pipeline and return the complete answer.
+        """
+        return "".join([chunk async for chunk in self.stream_single_intent(user_input)])
 
     def reasoning_loop(self, user_input):
         """
         Public reasoning entry point.
+        Runs the async pipeline to completion from synchronous
+        callers such as the Streamlit script thread.
+        """
+        return asyncio.run(self.process_single_intent(user_input))
+
+    def reasoning_loop_stream(self, user_input):
         """
-        return self.process_single_intent(user_input)
+        Streaming reasoning entry point.
+        Synchronous generator of answer chunks, suitable for
+        st.write_stream.
+        """
+        loop = asyncio.new_event_loop()
+        chunks = self.stream_single_intent(user_input)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(anext(chunks))
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(chunks.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
 
     def get_working_memory(self):
-        return self.short_term
+        return list(self.short_term)
 
     def get_internal_log(self):
-        return self.internal_log
+        return list(self.internal_log)
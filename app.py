@@ -37,7 +37,7 @@ with st.sidebar.expander("Agent Persona", expanded=True):
 if "agent" not in st.session_state:
     st.session_state.agent = Agent(st.session_state.config)
 else:
-    st.session_state.agent.config = st.session_state.config
+    st.session_state.agent.update_config(st.session_state.config)
 
 page = st.sidebar.radio("Navigation", ["Agent Interface", "Under the Hood"])
 
@@ -63,8 +63,17 @@ if page == "Agent Interface":
 
     if user_input:
         st.session_state.chat.append(("user", user_input))
-        response = st.session_state.agent.reasoning_loop(user_input)
+        with st.chat_message("user"):
+            st.write(user_input)
+
+        # Stream the answer as it is generated
+        with st.chat_message("assistant"):
+            response = st.write_stream(
+                st.session_state.agent.reasoning_loop_stream(user_input)
+            )
         st.session_state.chat.append(("assistant", response))
+
+        # Rerun so the proactive hint and To-Do board reflect this turn
         st.rerun()
 
     # To-Do board display
@@ -86,7 +95,7 @@ elif page == "Under the Hood":
     st.write("\n".join(st.session_state.agent.get_internal_log()))
 
     st.subheader("Long-Term Storage")
-    collection = st.session_state.agent.memory.collection.get()
+    collection = st.session_state.agent.memory.get_all()
     st.json(collection)
 
     if "distances" in collection:
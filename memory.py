@@ -1,45 +1,523 @@
-import chromadb
-from chromadb.utils import embedding_functions
+import atexit
+import collections
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+# Persistent storage for vector memory and cached embeddings
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MEMORY_DIR = os.path.join(BASE_DIR, "memory_store")
+EMBEDDING_CACHE_FILE = os.path.join(BASE_DIR, "embedding_cache.sqlite3")
+
+# Whitespace runs collapsed when normalizing cache keys
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# SentenceTransformer model and its output dimension
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+
+# Shared embedding model, loaded on first use
+_MODEL = None
+_MODEL_LOCK = threading.Lock()
+
+# Shared long-term memory stores, one per storage path
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+# Shared answer cache, created on first use
+_SEMANTIC_CACHE = None
+_SEMANTIC_CACHE_LOCK = threading.Lock()
+
+# Number of buffered memories that triggers a batched write
+FLUSH_SIZE = 8
+
+# Initial row capacity of the memory embedding matrix
+INITIAL_CAPACITY = 64
+
+
+def normalize(vec):
+    """
+    L2-normalize a vector so dot products equal cosine similarity.
+    """
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def get_embedding_model():
+    """
+    Return the process-wide SentenceTransformer instance.
+    On GPU the weights run in FP16; on CPU the Linear layers are
+    dynamically quantized to int8.
+    """
+    global _MODEL
+    with _MODEL_LOCK:
+        if _MODEL is None:
+            if torch.cuda.is_available():
+                _MODEL = SentenceTransformer(EMBEDDING_MODEL, device="cuda").half()
+            else:
+                _MODEL = torch.ao.quantization.quantize_dynamic(
+                    SentenceTransformer(EMBEDDING_MODEL, device="cpu"),
+                    {torch.nn.Linear},
+                    dtype=torch.qint8
+                )
+        return _MODEL
+
+
+class SentenceTransformerEmbedding:
+    """
+    Embedding function over the shared SentenceTransformer.
+    Returns L2-normalized float32 vectors, encoded in batches.
+    """
+
+    def __init__(self, batch_size=32):
+        self.batch_size = batch_size
+
+        # Identifies model and precision, for cache keys
+        precision = "fp16" if torch.cuda.is_available() else "int8"
+        self.name = f"{EMBEDDING_MODEL}/{precision}"
+
+    def __call__(self, input):
+        return get_embedding_model().encode(
+            list(input),
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        ).astype(np.float32)
+
+
+def _replace_file(path, data):
+    """
+    Write bytes to path atomically: readers see either the old or
+    the new file, never a partial write.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def memory_id(text):
+    """
+    Stable content ID for a memory entry.
+    Unlike hash(), identical across processes (no PYTHONHASHSEED salt).
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class CachedEmbedding:
+    """
+    Embedding function wrapper backed by an on-disk SQLite cache.
+    Texts are keyed by the SHA-256 of their normalized content, so
+    anything seen in a previous session (up to case, whitespace and
+    trailing punctuation) is not embedded again.
+    Keys are namespaced by the inner model name, so vectors from a
+    different model or precision are never mixed.
+    """
+
+    def __init__(self, inner, path=EMBEDDING_CACHE_FILE):
+        self.inner = inner
+        self.namespace = getattr(inner, "name", "")
+
+        # Connection is shared between Streamlit script threads
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key BLOB PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._db.commit()
+
+    def _key(self, text):
+        normalized = _WHITESPACE_RE.sub(" ", text.lower()).strip()
+        normalized = normalized.rstrip(".!?,").rstrip()
+        return hashlib.sha256(
+            f"{self.namespace}\0{normalized}".encode("utf-8")
+        ).digest()
+
+    def __call__(self, input):
+        """
+        Embed a batch of texts.
+        Only cache misses are sent to the inner model, in one call.
+        """
+        keys = [self._key(t) for t in input]
+        vectors = [None] * len(input)
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    vectors[i] = np.frombuffer(row[0], dtype=np.float32)
+
+        # Group misses by key so equivalent texts are embedded once
+        missing = {}
+        for i, v in enumerate(vectors):
+            if v is None:
+                missing.setdefault(keys[i], []).append(i)
+
+        if missing:
+            computed = self.inner([input[idx[0]] for idx in missing.values()])
+            rows = []
+            for (key, idx), vec in zip(missing.items(), computed):
+                vec = np.asarray(vec, dtype=np.float32)
+                for i in idx:
+                    vectors[i] = vec
+                rows.append((key, vec.tobytes()))
+
+            with self._lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows
+                )
+                self._db.commit()
+
+        return np.stack(vectors)
 
 
 class LongTermMemory:
     """
-    Vector-based long-term memory using ChromaDB.
+    Vector-based long-term memory using an exact inner-product index.
+    Embeddings are L2-normalized, so one matrix-vector product scores
+    every stored entry by cosine similarity.
     Stores semantic chunks and retrieves relevant context for RAG.
     """
 
-    def __init__(self):
-        self.client = chromadb.Client()
+    def __init__(self, path=MEMORY_DIR):
+        self.path = path
+        self.docs_file = os.path.join(path, "docs.json")
+        self.vectors_file = os.path.join(path, "vectors.npy")
 
-        # SentenceTransformer embedding for semantic similarity
-        self.embedding = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name="all-MiniLM-L6-v2"
-        )
+        # SentenceTransformer embedding for semantic similarity,
+        # cached on disk across sessions
+        self.embedding = CachedEmbedding(SentenceTransformerEmbedding())
 
-        self.collection = self.client.get_or_create_collection(
-            name="openclaw_memory",
-            embedding_function=self.embedding
-        )
+        # Stored entries; row i of vectors belongs to ids[i] / docs[i].
+        # The embedding matrix is preallocated and filled in place.
+        self.ids = []
+        self.docs = []
+        self._matrix = np.empty((INITIAL_CAPACITY, EMBEDDING_DIM), dtype=np.float32)
+        self.count = 0
+        self._known_ids = set()
 
-    def add_memory(self, text):
+        # Bumped on every write, so derived state (cached answers) knows to refresh
+        self.version = 0
+
+        # Write buffer, flushed as one batched add
+        self._pending_docs = []
+        self._pending_ids = []
+
+        # Writes may run on background workers while the agent queries
+        self._lock = threading.RLock()
+
+        self._load()
+
+    @property
+    def vectors(self):
         """
-        Add text entry to vector store.
-        Hash used as deterministic ID.
+        L2-normalized embeddings of all stored entries (a view).
         """
-        self.collection.add(
-            documents=[text],
-            ids=[str(hash(text))]
-        )
+        return self._matrix[:self.count]
 
-    def query(self, query, k=2):
+    def _reserve(self, n):
         """
-        Retrieve top-k relevant memories.
+        Ensure room for n more rows, doubling capacity when full.
         """
-        try:
-            return self.collection.query(
-                query_texts=[query],
-                n_results=k
+        needed = self.count + n
+        if needed > len(self._matrix):
+            grown = np.empty(
+                (max(needed, 2 * len(self._matrix)), EMBEDDING_DIM), dtype=np.float32
             )
+            grown[:self.count] = self.vectors
+            self._matrix = grown
+
+    def _load(self):
+        """
+        Restore persisted entries.
+        docs.json is authoritative: embeddings that are missing or out
+        of sync with it are recomputed instead of dropping entries.
+        """
+        if not os.path.exists(self.docs_file):
+            return
+        try:
+            with open(self.docs_file, "r", encoding="utf-8") as f:
+                docs = [e["document"] for e in json.load(f)]
+        except:
+            # Set the unreadable file aside rather than overwriting it
+            # on the next flush
+            os.replace(self.docs_file, self.docs_file + ".corrupt")
+            return
+
+        try:
+            vectors = np.load(self.vectors_file)
+            if vectors.ndim != 2 or vectors.shape[1] != EMBEDDING_DIM:
+                raise ValueError("unexpected embedding shape")
         except:
-            # Fail-safe fallback for query errors
-            return {"documents": [[]]}
\ No newline at end of file
+            vectors = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+        if len(vectors) < len(docs):
+            missing = self.embedding(docs[len(vectors):])
+            vectors = np.concatenate(
+                [vectors, np.stack([normalize(e) for e in missing])]
+            )
+        vectors = vectors[:len(docs)]
+
+        # IDs are derived from content, which also migrates older
+        # files written with process-salted hash() IDs
+        self.docs = docs
+        self.ids = [memory_id(d) for d in self.docs]
+        self._reserve(len(vectors))
+        self._matrix[:len(vectors)] = vectors
+        self.count = len(vectors)
+        self._known_ids = set(self.ids)
+
+    def _save(self):
+        """
+        Persist entries and embedding matrix to disk.
+        Each file is replaced atomically, vectors first, so an
+        interrupted save never leaves docs without their embeddings.
+        """
+        os.makedirs(self.path, exist_ok=True)
+
+        buffer = io.BytesIO()
+        np.save(buffer, self.vectors)
+        _replace_file(self.vectors_file, buffer.getvalue())
+
+        entries = [{"id": i, "document": d} for i, d in zip(self.ids, self.docs)]
+        _replace_file(self.docs_file, json.dumps(entries).encode("utf-8"))
+
+    def add_memory(self, text):
+        """
+        Queue text entry for the vector store.
+        Hash used as deterministic ID; known IDs are skipped.
+        Entries are embedded and written in batches of FLUSH_SIZE,
+        or earlier together with the next query embedding. Shared
+        stores flush whatever is still pending at exit.
+        """
+        with self._lock:
+            doc_id = memory_id(text)
+            if doc_id in self._known_ids or doc_id in self._pending_ids:
+                return
+
+            self._pending_docs.append(text)
+            self._pending_ids.append(doc_id)
+
+            if len(self._pending_docs) >= FLUSH_SIZE:
+                self.flush()
+
+    def flush(self, embeddings=None):
+        """
+        Embed and append all pending entries in one batch, then persist.
+        Precomputed embeddings skip the embedding pass.
+        """
+        with self._lock:
+            if not self._pending_docs:
+                return
+
+            if embeddings is None:
+                embeddings = self.embedding(self._pending_docs)
+
+            vectors = np.stack([normalize(e) for e in embeddings])
+            self._reserve(len(vectors))
+            self._matrix[self.count:self.count + len(vectors)] = vectors
+            self.count += len(vectors)
+            self.version += 1
+            self.ids.extend(self._pending_ids)
+            self.docs.extend(self._pending_docs)
+            self._known_ids.update(self._pending_ids)
+
+            self._pending_docs = []
+            self._pending_ids = []
+            self._save()
+
+    def embed(self, text):
+        """
+        Embed a single text with the memory's embedding model.
+        Pending writes, typically queued by the previous turn, are
+        encoded in the same batch and flushed, so they cost no
+        forward pass of their own.
+        """
+        with self._lock:
+            if self._pending_docs:
+                vectors = self.embedding(self._pending_docs + [text])
+                self.flush(embeddings=vectors[:-1])
+                return np.asarray(vectors[-1], dtype=np.float32)
+
+            return np.asarray(self.embedding([text])[0], dtype=np.float32)
+
+    def query(self, query, k=2, query_embedding=None):
+        """
+        Retrieve top-k relevant memories.
+        A precomputed query embedding skips the embedding pass.
+        Result mirrors the Chroma query shape, with cosine distances.
+        """
+        with self._lock:
+            try:
+                if query_embedding is None:
+                    query_embedding = self.embed(query)
+                else:
+                    self.flush()
+
+                scores = self.vectors @ normalize(query_embedding)
+
+                k = min(k, len(scores))
+                if k == 0:
+                    return {"ids": [[]], "documents": [[]], "distances": [[]]}
+
+                # Partial sort: only the k best rows are ordered
+                top = np.argpartition(scores, -k)[-k:]
+                top = top[np.argsort(-scores[top])]
+
+                return {
+                    "ids": [[self.ids[i] for i in top]],
+                    "documents": [[self.docs[i] for i in top]],
+                    "distances": [[float(1.0 - scores[i]) for i in top]],
+                }
+            except:
+                # Fail-safe fallback for query errors
+                return {"documents": [[]]}
+
+    def get_all(self):
+        """
+        Return every stored entry, including pending writes.
+        """
+        with self._lock:
+            self.flush()
+            return {"ids": list(self.ids), "documents": list(self.docs)}
+
+
+def get_long_term_memory(path=MEMORY_DIR):
+    """
+    Return the process-wide long-term memory for a storage path.
+    Sessions share one instance, so their writes land in the same
+    store instead of overwriting each other's files.
+    Pending writes are flushed at interpreter exit.
+    """
+    path = os.path.abspath(path)
+    with _STORES_LOCK:
+        if path not in _STORES:
+            _STORES[path] = LongTermMemory(path)
+            atexit.register(_STORES[path].flush)
+        return _STORES[path]
+
+
+class SemanticCache:
+    """
+    Similarity cache for LLM answers.
+    Returns a stored response when a new query embedding is close
+    enough (cosine similarity) to a previously answered one that was
+    asked in the same context. Answers stored with an exact key can
+    also be found by that key, without embedding the query; both
+    share the same TTL and size limit.
+    """
+
+    def __init__(self, threshold=0.95, max_entries=256, ttl=3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # (normalized embedding, response, timestamp, context key)
+        self.entries = []
+
+        # Exact key -> (response, timestamp), in insertion order
+        self.exact = collections.OrderedDict()
+
+        # Stacked embedding matrix and context keys, rebuilt lazily after changes
+        self._matrix = None
+        self._contexts = None
+
+        # Shared by all sessions of the process
+        self._lock = threading.Lock()
+
+    def _invalidate(self):
+        self._matrix = None
+        self._contexts = None
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        if self.entries and self.entries[0][2] < cutoff:
+            self.entries = [e for e in self.entries if e[2] >= cutoff]
+            self._invalidate()
+
+    def lookup(self, embedding, context=None):
+        """
+        Return cached response for the closest prior query asked in
+        the same context, or None if nothing exceeds the similarity
+        threshold.
+        """
+        with self._lock:
+            self._expire()
+            if not self.entries:
+                return None
+
+            if self._matrix is None:
+                self._matrix = np.stack([e[0] for e in self.entries])
+                self._contexts = np.array([e[3] for e in self.entries], dtype=object)
+
+            scores = self._matrix @ normalize(embedding)
+            scores = np.where(self._contexts == context, scores, -np.inf)
+
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                return self.entries[best][1]
+            return None
+
+    def lookup_exact(self, key):
+        """
+        Return the cached response stored under an exact key, or None
+        if there is none or it has expired.
+        """
+        with self._lock:
+            item = self.exact.get(key)
+            if item is None:
+                return None
+            if item[1] < time.time() - self.ttl:
+                del self.exact[key]
+                return None
+            return item[0]
+
+    def add(self, embedding, response, context=None, key=None):
+        """
+        Store response for the given query embedding and context,
+        and under an exact key if given.
+        Oldest entries are evicted beyond max_entries.
+        """
+        with self._lock:
+            now = time.time()
+            self.entries.append((normalize(embedding), response, now, context))
+            self.entries = self.entries[-self.max_entries:]
+            self._invalidate()
+
+            if key is not None:
+                self.exact.pop(key, None)
+                self.exact[key] = (response, now)
+                while len(self.exact) > self.max_entries:
+                    self.exact.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries = []
+            self.exact.clear()
+            self._invalidate()
+
+
+def get_semantic_cache():
+    """
+    Return the process-wide answer cache.
+    Entries are keyed by everything the answer depends on, so
+    sessions with the same prompt can reuse each other's answers.
+    """
+    global _SEMANTIC_CACHE
+    with _SEMANTIC_CACHE_LOCK:
+        if _SEMANTIC_CACHE is None:
+            _SEMANTIC_CACHE = SemanticCache()
+        return _SEMANTIC_CACHE
\ No newline at end of file
@@ -1,33 +1,65 @@
 import json
 import os
 
+import numpy as np
+
 # Persistent storage for To-Do items using local JSON file
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TODO_FILE = os.path.join(BASE_DIR, "todo.json")
 
+# Parsed file contents, reused until the file's mtime changes
+_CACHE = {"mtime": None, "data": None}
 
-def load_todos():
+
+def _read_todos():
     """
-    Load all tasks from persistent storage.
-    Returns empty list if file does not exist or is unreadable.
+    Return the cached parsed file, re-reading it only when its
+    mtime changes. The result is shared and must not be mutated.
     """
-    if not os.path.exists(TODO_FILE):
+    try:
+        mtime = os.stat(TODO_FILE).st_mtime_ns
+    except OSError:
         return []
     try:
-        with open(TODO_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        if _CACHE["mtime"] != mtime:
+            with open(TODO_FILE, "r", encoding="utf-8") as f:
+                _CACHE["data"] = json.load(f)
+            _CACHE["mtime"] = mtime
+        return _CACHE["data"]
     except:
         # Fail-safe to avoid agent crash due to malformed file
         return []
 
 
+def load_todos():
+    """
+    Load all tasks from persistent storage.
+    Returns empty list if file does not exist or is unreadable.
+    Callers get a copy they are free to mutate.
+    """
+    return [dict(t) for t in _read_todos()]
+
+
+def load_todos_soa():
+    """
+    Load tasks as parallel columns: task texts and a boolean done mask.
+    Lets callers filter by status with array operations.
+    """
+    todos = _read_todos()
+    tasks = [t["task"] for t in todos]
+    done = np.fromiter((t["done"] for t in todos), dtype=bool, count=len(todos))
+    return tasks, done
+
+
 def save_todos(todos):
     """
-    Persist task list to disk.
+    Persist task list to disk and refresh the load cache.
     """
     try:
         with open(TODO_FILE, "w", encoding="utf-8") as f:
-            json.dump(todos, f, indent=2)
+            json.dump(todos, f)
+        _CACHE["data"] = [dict(t) for t in todos]
+        _CACHE["mtime"] = os.stat(TODO_FILE).st_mtime_ns
     except PermissionError:
         print("Permission denied when writing todo.json")
 
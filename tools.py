@@ -1,21 +1,29 @@
 from duckduckgo_search import DDGS
-from todo import add_task, mark_done, load_todos
+from todo import add_task, mark_done, load_todos, load_todos_soa
 from datetime import datetime
-import difflib
+import numpy as np
+from rapidfuzz import fuzz, process
 
 # Supported tool actions (used for model instruction)
 VALID_ACTIONS = ["search", "add_todo", "complete_todo", "date", "none"]
 
+# Seconds the search client waits on DuckDuckGo before giving up
+SEARCH_TIMEOUT = 5
+
+# Minimum fuzzy score (0-100) for a task completion match
+MATCH_CUTOFF = 45
+
 
 def internet_search(query):
     """
     Lightweight internet search wrapper using DuckDuckGo.
     Appends contextual keywords to improve relevance for smaller models.
+    Requests time out after SEARCH_TIMEOUT seconds.
     """
     try:
         query = query + " explanation meaning context"
 
-        with DDGS() as ddgs:
+        with DDGS(timeout=SEARCH_TIMEOUT) as ddgs:
             results = list(ddgs.text(query, max_results=6))
 
         if not results:
@@ -49,25 +57,27 @@ def complete_todo(task_text):
     """
     Fuzzy match task text and mark best candidate as done.
     """
-    todos = load_todos()
+    tasks, done = load_todos_soa()
 
-    if not todos:
+    if not tasks:
         return "There are no tasks to complete."
 
-    best_match = None
-    best_score = 0
-
-    for i, t in enumerate(todos):
-        if not t["done"]:
-            score = difflib.SequenceMatcher(
-                None, task_text.lower(), t["task"].lower()
-            ).ratio()
-            if score > best_score:
-                best_score = score
-                best_match = i
-
-    if best_match is not None and best_score > 0.45:
-        return mark_done(best_match)
+    pending = np.flatnonzero(~done)
+    if not len(pending):
+        return "No matching task found."
+
+    # Score all pending tasks in one batched call; a plain ratio
+    # prefers the full task over a shorter task it contains
+    scores = process.cdist(
+        [task_text.lower()],
+        [tasks[i].lower() for i in pending],
+        scorer=fuzz.ratio,
+        score_cutoff=MATCH_CUTOFF
+    )[0]
+
+    best = int(np.argmax(scores))
+    if scores[best] >= MATCH_CUTOFF:
+        return mark_done(int(pending[best]))
 
     return "No matching task found."
 